@@ -28,19 +28,282 @@
 
 import os
 import re
-import io
 import sys
+import io
 import html
+import codecs
 import jinja2
 import shutil
 import urllib
+import hashlib
+import gzip
+import functools
+import mmap
+import json
 import datetime
 import argparse
+import threading
 import requests
 import http.client
+import concurrent.futures
 
 from PIL import Image
 
+# Splits a config file line into its keyword and (optional) value.  Leading
+# whitespace is ignored, and lines whose first real char is a hash won't
+# match at all.  Trailing whitespace is left on the value, since that might
+# be part of a pattern; everything else calls rstrip() on it.
+_CFG_LINE_RE = re.compile(r'\s*(?P<key>[^\s#]\S*)(?:\s+(?P<value>\S[^\r\n]*))?')
+
+# Pulls the date out of the start of one of our image filenames
+_DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})-')
+
+def page_filename(date):
+    """
+    Returns the filename of the dailystrips HTML page for the given date
+    """
+    return 'dailystrips-%04d.%02d.%02d.html' % (date.year, date.month, date.day)
+
+def _sniff_format(data):
+    """
+    Given the first few bytes of an image, returns the file extension
+    for it if it's one of the common formats we know the signatures of.
+    Returns None otherwise.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    elif data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    elif data.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def _page_encoding(resp):
+    """
+    Returns the encoding to decode matches from the given HTML response
+    with.  requests assumes ISO-8859-1 for any text/* response without a
+    charset, but these days such pages are nearly always UTF-8, so only
+    trust its idea of the encoding if the server actually specified one
+    (and it's one Python knows about).
+    """
+    if resp.encoding and 'charset' in resp.headers.get('Content-Type', '').lower():
+        try:
+            codecs.lookup(resp.encoding)
+            return resp.encoding
+        except LookupError:
+            pass
+    return 'utf-8'
+
+# Bits of regex syntax which behave differently for bytes patterns: the
+# character classes (and case-insensitive matching) only understand ASCII,
+# counted repeats would count bytes rather than characters, and hex/octal
+# escapes would refer to bytes rather than characters.
+_BYTES_UNSAFE_RE = re.compile(r'\\[wWdDsSbBx]|\\[0-7]{3}|\(\?[a-zA-Z-]*i|\{\d*,?\d*\}')
+
+def _compile_search(pattern):
+    """
+    Compiles the given regex with re.MULTILINE, returning a tuple of the
+    compiled str regex, and a bytes version which can be used to search
+    undecoded pages (or None, if the pattern might match differently as
+    bytes).  Raises re.error if the pattern is invalid.
+    """
+    str_re = re.compile(pattern, re.MULTILINE)
+    bytes_re = None
+    if pattern.isascii() and not _BYTES_UNSAFE_RE.search(pattern):
+        try:
+            bytes_re = re.compile(pattern.encode('ascii'), re.MULTILINE)
+        except re.error:
+            # Some escapes (\N, \u, etc) are only allowed in str patterns
+            pass
+    return (str_re, bytes_re)
+
+@functools.lru_cache(maxsize=None)
+def _bytes_searchable(encoding):
+    """
+    Returns True if pages in the given encoding can be searched with an
+    ASCII bytes regex, and get the same results as searching the decoded
+    text.  That means UTF-8 (where ASCII bytes never turn up inside other
+    characters), or a single-byte encoding which agrees with ASCII.
+    """
+    ascii_bytes = bytes(range(128))
+    try:
+        if codecs.lookup(encoding).name == 'utf-8':
+            return True
+        return (ascii_bytes.decode(encoding, errors='replace') == ascii_bytes.decode('ascii') and
+            len(bytes(range(256)).decode(encoding, errors='replace')) == 256)
+    except LookupError:
+        return False
+
+# User-Agent we send by default
+DEFAULT_USERAGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:51.0) Gecko/20100101 Firefox/51.0'
+
+# Where our template, default CSS, and default config live
+_MODULE_DIR = os.path.dirname(__file__)
+
+# Where we keep data which is only there to speed up later runs, and can
+# be safely deleted at any time
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'pydailystrips')
+
+@functools.lru_cache(maxsize=1)
+def _main_template():
+    """
+    Returns our main Jinja2 page template.  This is only loaded and
+    compiled once, no matter how many Collections get created.  We don't
+    need Jinja2 to keep checking whether the template file has changed,
+    either.  The compiled template is also cached on disk, if we can, so
+    that later runs don't have to compile it at all.
+    """
+    bytecode_cache = None
+    bytecode_dir = os.path.join(CACHE_DIR, 'templates')
+    try:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_dir)
+    except OSError:
+        pass
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(_MODULE_DIR),
+        auto_reload=False,
+        bytecode_cache=bytecode_cache)
+    return env.get_template('dailystrips-main.html')
+
+def human_date(date):
+    """
+    Returns the given date in the format we show to people
+    """
+    return date.strftime('%A, %B %d, %Y')
+
+class PageCache(object):
+    """
+    A small on-disk cache of the HTML pages we've fetched, so that we can
+    send conditional requests for them next time and reuse our copy if the
+    server says it hasn't changed.  The ETag/Last-Modified info for every
+    page lives in a single JSON index (written out by save()), and each
+    page body gets its own file.  Pages we haven't asked for in MAX_AGE
+    days (such as yesterday's dated intermediate pages) are dropped when
+    the index is saved.  If the cache directory can't be created,
+    pages are just fetched as normal.
+    """
+
+    INDEX_FILENAME = 'index.json'
+    MAX_AGE = datetime.timedelta(days=7)
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_filename = os.path.join(cache_dir, PageCache.INDEX_FILENAME)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.today = datetime.date.today()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.enabled = True
+        except OSError:
+            self.enabled = False
+        try:
+            with open(self.index_filename) as df:
+                self.pages = json.load(df)
+        except (OSError, ValueError):
+            self.pages = {}
+
+    def body_filename(self, url):
+        """
+        Returns the filename we store the body of the given URL in
+        """
+        return os.path.join(self.cache_dir, '%s.html' % (
+            hashlib.sha256(url.encode('utf-8')).hexdigest()))
+
+    def fetch(self, session, url):
+        """
+        Fetches the given URL using the given requests.Session, returning
+        a tuple of the page body (as bytes) and the encoding to decode it
+        with.
+        """
+        if not self.enabled:
+            resp = session.get(url, verify=session.verify)
+            return (resp.content, _page_encoding(resp))
+
+        headers = {}
+        with self.lock:
+            entry = self.pages.get(url)
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = session.get(url, headers=headers, verify=session.verify)
+        if resp.status_code == 304 and entry:
+            try:
+                with open(self.body_filename(url), 'rb') as df:
+                    page_data = df.read()
+                with self.lock:
+                    if entry.get('used') != self.today.isoformat():
+                        entry['used'] = self.today.isoformat()
+                        self.dirty = True
+                return (page_data, entry['encoding'])
+            except OSError:
+                # Our copy has gone missing, so ask for the whole page again
+                resp = session.get(url, verify=session.verify)
+
+        page_data = resp.content
+        page_encoding = _page_encoding(resp)
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if resp.status_code == 200 and (etag or last_modified):
+            body_filename = self.body_filename(url)
+            with self.lock:
+                try:
+                    with open(body_filename + Pattern.TMP_EXT, 'wb') as df:
+                        df.write(page_data)
+                    os.replace(body_filename + Pattern.TMP_EXT, body_filename)
+                    self.pages[url] = {
+                        'etag': etag,
+                        'last_modified': last_modified,
+                        'encoding': page_encoding,
+                        'used': self.today.isoformat(),
+                    }
+                    self.dirty = True
+                except OSError:
+                    pass
+        return (page_data, page_encoding)
+
+    def prune(self):
+        """
+        Drops any pages which haven't been used in the last MAX_AGE days,
+        along with their stored bodies.  Entries from before we kept track
+        of that are dropped too.
+        """
+        cutoff = (self.today - PageCache.MAX_AGE).isoformat()
+        for url, entry in list(self.pages.items()):
+            if entry.get('used', '') < cutoff:
+                del self.pages[url]
+                self.dirty = True
+                try:
+                    os.unlink(self.body_filename(url))
+                except OSError:
+                    pass
+
+    def save(self):
+        """
+        Prunes old pages, and then writes out our index if anything's
+        changed
+        """
+        if not self.enabled:
+            return
+        self.prune()
+        if not self.dirty:
+            return
+        tmp_filename = self.index_filename + Pattern.TMP_EXT
+        try:
+            with open(tmp_filename, 'w') as df:
+                json.dump(self.pages, df)
+            os.replace(tmp_filename, self.index_filename)
+            self.dirty = False
+        except OSError:
+            pass
+
 class Pattern(object):
     """
     A pattern that we'll be retreiving from the HTML page.  Can
@@ -66,53 +329,134 @@ class Pattern(object):
         'GIF': 'gif',
     }
 
+    # Used to turn titles into strings suitable for filenames and CSS.  The
+    # translation table handles the (usual) all-ASCII case, and the regex
+    # does the same job for anything else.
+    _ID_TABLE = str.maketrans({chr(c): '_' for c in range(128)
+        if not ('0' <= chr(c) <= '9' or 'a' <= chr(c) <= 'z')})
+    _ID_RE = re.compile(r'[^0-9a-z]')
+
+    # Extension for the files we store image hashes in, alongside the images
+    HASH_EXT = '.sha256'
+
+    # Extension for the files we store HTTP response information in
+    INFO_EXT = '.headers.json'
+
+    # Extension for images which are still being downloaded
+    TMP_EXT = '.download'
+
+    # How much data to read at once when streaming images
+    CHUNK_SIZE = 65536
+
+    # Returned by fetch_image() when the server says our image is unchanged
+    NOT_MODIFIED = object()
+
+    # Returned by fetch_image() when we already have today's image
+    ALREADY_FETCHED = object()
+
     def __init__(self, title, pattern, mode=1):
         self.title = title
         self.pattern = pattern
         self.mode = mode
         self.baseurl = ''
         self.result = None
+        self._unescaped = None
         self.error = None
         self.url = None
         self.unchanged_since = None
+        self.last_info = None
+        self.etag = None
+        self.last_modified = None
+        self.new_hash = None
+        self.new_size = None
+        self.new_ext = None
+        self.today_info = None
 
         # String appropriate for inclusion in CSS classnames/IDs, filenames, etc.
-        self.id = re.sub('[^0-9a-z]', '_', self.title.lower())
+        title_lower = self.title.lower()
+        if title_lower.isascii():
+            self.id = title_lower.translate(Pattern._ID_TABLE)
+        else:
+            self.id = Pattern._ID_RE.sub('_', title_lower)
+
+        # Compile our regex up front, so it only ever happens once
+        self._search_re = None
+        self._search_bytes_re = None
+        self.compile_error = None
+        if self.pattern is not None:
+            self.compile()
+
+    def compile(self):
+        """
+        Compiles our regex pattern.  This is done with re.MULTILINE, so ^
+        and $ will still anchor to individual lines of the page.  Where it's
+        safe to, the regex is compiled as bytes as well, so that we can
+        search pages without having to decode them first (see
+        _compile_search()).  If the regex is invalid, the error is stored in
+        `self.compile_error` rather than raised.
+        """
+        self._search_re = None
+        self._search_bytes_re = None
+        self.compile_error = None
+        try:
+            (self._search_re, self._search_bytes_re) = _compile_search(self.pattern)
+        except re.error as e:
+            self.compile_error = 'Error parsing regex: %s' % (e)
+
+    def searches_bytes(self, encoding):
+        """
+        Returns True if we can search an undecoded page in the given
+        encoding, rather than needing it decoded first.
+        """
+        return self._search_bytes_re is not None and _bytes_searchable(encoding)
 
-    def search_page(self, pagedata, verbose=False):
+    def search_page(self, pagedata, verbose=False, encoding='utf-8'):
         """
-        Given pagedata (a list of strings), matches its contents
-        using group 1 of our regex pattern.  We don't actually
-        compile the regex until now, so that we don't accidentally
-        waste time compiling on patterns we never attempt.  Returns
-        True if we matched, and False otherwise.
+        Given pagedata (the full page, either undecoded bytes or a decoded
+        str), matches its contents using group 1 of our (already-compiled)
+        regex pattern.  When searching bytes, only the matched result gets
+        decoded, using the given encoding, unless searches_bytes() says we
+        can't, in which case the whole page is decoded.  For backwards
+        compatibility, a list of lines (as from str.splitlines()) is
+        accepted too.  Returns True if we matched, and False otherwise.
         """
         if verbose:
             print('* Searching for "%s" pattern: %s' % (self.title, self.pattern))
-        try:
-            search_re = re.compile(self.pattern)
-        except Exception as e:
-            self.error = 'Error parsing regex: %s' % (e)
+        if self.compile_error:
+            self.error = self.compile_error
             return False
-        for line in pagedata:
-            match = search_re.search(line)
+        if isinstance(pagedata, list):
+            pagedata = '\n'.join(pagedata)
+        result = None
+        if isinstance(pagedata, bytes):
+            if self.searches_bytes(encoding):
+                match = self._search_bytes_re.search(pagedata)
+                if match:
+                    result = match.group('result').decode(encoding, errors='replace')
+            else:
+                pagedata = pagedata.decode(encoding, errors='replace')
+        if isinstance(pagedata, str):
+            match = self._search_re.search(pagedata)
             if match:
-                self.result = match.group('result')
-                return True
+                result = match.group('result')
+        if result is not None:
+            self.result = result
+            self._unescaped = html.unescape(self.result)
+            return True
         self.error = 'Could not find "%s" pattern in HTML' % (self.title)
         return False
 
     def get_result(self):
         """
-        Returns our result, or None
+        Returns our (unescaped) result, or None
         """
         if self.result is None:
             return None
         else:
             if self.is_image():
-                return '%s%s' % (self.baseurl, html.unescape(self.result))
+                return '%s%s' % (self.baseurl, self._unescaped)
             else:
-                return html.unescape(self.result)
+                return self._unescaped
 
     def get_error(self):
         """
@@ -127,64 +471,348 @@ class Pattern(object):
         """
         return (self.mode == Pattern.M_IMG)
 
-    def download_to(self, basedir, linkdir, now, referer=None, verbose=False, useragent=None, ca_certs=None):
+    def fetch_image(self, session, basedir, now, referer=None, verbose=False, force=False):
         """
-        Downloads ourself to the given directory.
+        Fetches our image from the web (using the given requests.Session)
+        into a temporary file inside `basedir`,
+        returning the temporary filename (see stream_to_file()), and figuring
+        out its image type into `self.new_ext`.  If the server
+        tells us that the image hasn't changed since yesterday's download,
+        returns Pattern.NOT_MODIFIED instead, and if we already saved this
+        image earlier today (and `force` isn't set), returns
+        Pattern.ALREADY_FETCHED.  Returns None if we're not an
+        image, if we didn't match, or if there was an error retrieving the
+        image (in which case our error will be set).
         """
 
         # Only download if we're an image
         if not self.is_image():
-            return
+            return None
 
         # Also only download if we actually matched
         if self.error or not self.result:
-            return
+            return None
+
+        # If an earlier run today already saved this same image, there's no
+        # need to fetch it again, unless we've been told to.
+        if not force:
+            self.today_info = self.read_info(basedir, now)
+            if self.today_info and self.today_info.get('url') == self.get_result():
+                if verbose:
+                    print(' * Already have today\'s "%s" image' % (self.title))
+                return Pattern.ALREADY_FETCHED
 
         # Set up our headers
         headers = {}
         if referer:
             headers['Referer'] = referer
-        if useragent:
-            headers['User-Agent'] = useragent
+
+        # If we know what yesterday's image looked like on the server, ask
+        # the server to only send the image if it's changed.  That only
+        # makes sense if it's the same URL as yesterday, though -- most
+        # strips get a new URL every day, and the server would be comparing
+        # our headers against a different file.
+        yesterday = now - datetime.timedelta(days=1)
+        self.last_info = self.read_info(basedir, yesterday)
+        same_url = bool(self.last_info) and self.last_info.get('url') == self.get_result()
+        if same_url:
+            if self.last_info['etag']:
+                headers['If-None-Match'] = self.last_info['etag']
+            if self.last_info['last_modified']:
+                headers['If-Modified-Since'] = self.last_info['last_modified']
 
         # Grab the image
         try:
             if verbose:
                 print(' * Fetching "%s" image at URL: %s' % (self.title, self.get_result()))
-            if ca_certs:
-                resp = requests.get(self.get_result(), headers=headers, verify=ca_certs)
-            else:
-                resp = requests.get(self.get_result(), headers=headers)
-            if resp.status_code == 200:
-                new_image_data = resp.content
-            else:
-                self.error = 'ERROR: Received HTTP %d: %s' % (resp.status_code, resp.reason)
-                if verbose:
-                    print(self.error)
-                    print('')
-                return
+            if same_url and self.check_unchanged(session, basedir, headers, verbose):
+                return Pattern.NOT_MODIFIED
+            resp = session.get(self.get_result(), headers=headers,
+                verify=session.verify, stream=True)
+            with resp:
+                if resp.status_code == 304 and same_url:
+                    if verbose:
+                        print('    Image is not modified on the server')
+                    self.etag = resp.headers.get('ETag', self.last_info['etag'])
+                    self.last_modified = resp.headers.get('Last-Modified',
+                        self.last_info['last_modified'])
+                    return Pattern.NOT_MODIFIED
+                elif resp.status_code == 200:
+                    self.etag = resp.headers.get('ETag')
+                    self.last_modified = resp.headers.get('Last-Modified')
+                    new_image = self.stream_to_file(resp, basedir)
+                else:
+                    self.error = 'ERROR: Received HTTP %d: %s' % (resp.status_code, resp.reason)
+                    if verbose:
+                        print(self.error)
+                        print('')
+                    return None
         except Exception as e:
             self.error = 'ERROR: Unable to retreive "%s" image: %s' % (self.title, e)
             if verbose:
                 print(self.error)
                 print('')
-            return
+            return None
 
-        # Load it into PIL to determine its file type (we can't trust extensions, and
-        # some of our strips don't even have extensions on the file)
+        # Figure out the image type while we're still off in a worker thread,
+        # since that may mean having PIL read and parse the image.
         try:
-            im = Image.open(io.BytesIO(new_image_data))
-            if im.format in Pattern.IMG_TO_EXT:
-                ext = Pattern.IMG_TO_EXT[im.format]
-            else:
-                ext = im.format.lower()
+            self.new_ext = self.image_ext(new_image)
         except Exception as e:
+            os.unlink(new_image)
             self.error = 'ERROR: Unable to determine "%s" image type: %s' % (self.title, e)
             if verbose:
                 print(self.error)
                 print('')
+            return None
+
+        return new_image
+
+    def stream_to_file(self, resp, basedir):
+        """
+        Streams the body of the given response into a temporary file inside
+        `basedir`, hashing it as we go so that we never have to hold the whole
+        image in memory.  Returns the temporary filename, and stores the hash
+        and size in `self.new_hash` and `self.new_size`.  save_image() will
+        move the file into place.
+        """
+        # We don't use the tempfile module here because it creates files which
+        # only we can read, and these generally end up being served on the web.
+        tmp_filename = os.path.join(basedir, '.%s%s' % (self.id, Pattern.TMP_EXT))
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_filename, 'wb') as df:
+                for chunk in resp.iter_content(chunk_size=Pattern.CHUNK_SIZE):
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    df.write(chunk)
+        except:
+            os.unlink(tmp_filename)
+            raise
+        self.new_hash = hasher.hexdigest()
+        self.new_size = size
+        return tmp_filename
+
+    def check_unchanged(self, session, basedir, headers, verbose=False):
+        """
+        Sends a HEAD request for our image and compares the result against
+        yesterday's stored response info, which must be for the same URL.
+        Returns True if the image looks to be unchanged, in which case
+        there's no need to GET it at all.
+        The size of yesterday's file must match Content-Length, and since a
+        size alone could easily collide, at least one of ETag or
+        Last-Modified must also match.  Servers which don't support HEAD
+        (405/501 and the like), or which don't send any of that, just
+        result in False.
+        """
+        try:
+            resp = session.head(self.get_result(), headers=headers,
+                verify=session.verify)
+        except requests.RequestException:
+            # If HEAD doesn't work out, we'll just try the GET
+            return False
+        if resp.status_code == 304:
+            # We send our conditional headers along, so the server may just
+            # tell us outright.
+            if verbose:
+                print('    HEAD request shows image is not modified on the server')
+            self.etag = resp.headers.get('ETag', self.last_info['etag'])
+            self.last_modified = resp.headers.get('Last-Modified',
+                self.last_info['last_modified'])
+            return True
+        elif resp.status_code != 200:
+            return False
+
+        try:
+            length = int(resp.headers.get('Content-Length', -1))
+            if length != os.path.getsize(os.path.join(basedir, self.last_info['filename'])):
+                return False
+        except (OSError, ValueError):
+            return False
+
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if etag and etag == self.last_info['etag']:
+            pass
+        elif last_modified and last_modified == self.last_info['last_modified']:
+            pass
+        else:
+            return False
+
+        if verbose:
+            print('    HEAD request shows image is unchanged')
+        self.etag = etag
+        self.last_modified = last_modified
+        return True
+
+    def read_hash(self, img_filename):
+        """
+        Returns the hash stored alongside the given image filename, or None
+        if we don't have one.
+        """
+        try:
+            with open(img_filename + Pattern.HASH_EXT, 'r') as df:
+                return df.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def write_hash(self, img_filename, img_hash):
+        """
+        Stores the given hash alongside the given image filename.
+        """
+        with open(img_filename + Pattern.HASH_EXT, 'w') as df:
+            df.write(img_hash)
+
+    def info_filename(self, basedir, date):
+        """
+        Returns the filename we use to store information about the HTTP
+        response for our image on the given date.  This can't depend on
+        the image's extension, since we need it before downloading.
+        """
+        return os.path.join(basedir, '%04d-%02d-%02d-%s%s' % (date.year,
+            date.month, date.day, self.id, Pattern.INFO_EXT))
+
+    def read_info(self, basedir, date):
+        """
+        Returns the stored response information for the given date, as a dict
+        with the keys `filename`, `etag`, `last_modified`, and `url` (which
+        may be missing from older info files).  Returns None if
+        we don't have that information, or if the image it refers to is no
+        longer present.
+        """
+        try:
+            with open(self.info_filename(basedir, date), 'r') as df:
+                info = json.load(df)
+            if os.path.exists(os.path.join(basedir, info['filename'])):
+                return info
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def write_info(self, basedir, date, img_filename_base):
+        """
+        Stores information about today's HTTP response, so that tomorrow we
+        can make a conditional request.
+        """
+        with open(self.info_filename(basedir, date), 'w') as df:
+            json.dump({
+                    'filename': img_filename_base,
+                    'etag': self.etag,
+                    'last_modified': self.last_modified,
+                    'url': self.get_result(),
+                }, df)
+
+    def same_contents(self, filename1, filename2):
+        """
+        Returns True if the two given files have identical contents.  The
+        files are memory-mapped and compared a chunk at a time, so neither
+        one gets read into memory all at once, and we stop at the first
+        difference.
+        """
+        with open(filename1, 'rb') as df1, open(filename2, 'rb') as df2:
+            # mmap refuses to map empty files
+            size1 = os.fstat(df1.fileno()).st_size
+            size2 = os.fstat(df2.fileno()).st_size
+            if size1 != size2:
+                return False
+            elif size1 == 0:
+                return True
+            with mmap.mmap(df1.fileno(), 0, access=mmap.ACCESS_READ) as mm1, \
+                    mmap.mmap(df2.fileno(), 0, access=mmap.ACCESS_READ) as mm2:
+                for offset in range(0, size1, Pattern.CHUNK_SIZE):
+                    end = offset + Pattern.CHUNK_SIZE
+                    if mm1[offset:end] != mm2[offset:end]:
+                        return False
+        return True
+
+    def image_ext(self, image_filename):
+        """
+        Returns the file extension to use for the given downloaded image.
+        We first check the first few bytes of the file for the signatures of
+        common formats.  Failing that, load it into PIL to determine its file
+        type.  We don't trust the URL's extension, since a server may well
+        hand back an HTML error page for an image URL.  Will raise an
+        Exception if PIL can't figure it out.  PIL's own error would include
+        our temporary filename, which isn't something to put on the page.
+        """
+        with open(image_filename, 'rb') as df:
+            ext = _sniff_format(df.read(12))
+            if ext:
+                return ext
+            df.seek(0)
+            try:
+                im = Image.open(df)
+            except Image.UnidentifiedImageError:
+                raise Exception('not a recognized image format')
+            with im:
+                if im.format in Pattern.IMG_TO_EXT:
+                    return Pattern.IMG_TO_EXT[im.format]
+                else:
+                    return im.format.lower()
+
+    def unchanged_date(self, filename, full_filename, verbose=False):
+        """
+        Given the filename of an image we've symlinked to (and its full
+        path), returns the date it's been unchanged since.  That's usually
+        the date at the start of the filename, but if the filename doesn't
+        match our standard pattern, we fall back to the file's mtime.
+        """
+        match = _DATE_RE.match(filename)
+        if match:
+            try:
+                return datetime.date(int(match.group(1)),
+                    int(match.group(2)),
+                    int(match.group(3)))
+            except ValueError:
+                pass
+        if verbose:
+            print('    Strip is on hold but previous filename cannot be parsed, using previous file\'s mtime')
+        return datetime.datetime.fromtimestamp(os.path.getmtime(full_filename))
+
+    def use_existing(self, basedir, linkdir, verbose=False):
+        """
+        Uses the image we already saved today (described by
+        `self.today_info`), rather than a newly-fetched one.
+        """
+        img_filename_base = self.today_info['filename']
+        img_filename = os.path.join(basedir, img_filename_base)
+        try:
+            # If today's image is a symlink, it's unchanged since whatever
+            # it points to.
+            try:
+                real_file = os.readlink(img_filename)
+            except OSError:
+                real_file = None
+            if real_file:
+                self.unchanged_since = self.unchanged_date(real_file,
+                    os.path.join(basedir, real_file), verbose=verbose)
+            self.url = os.path.join(urllib.parse.quote(linkdir), img_filename_base)
+        except Exception as e:
+            self.error = 'ERROR: Unable to use existing %s image: %s' % (self.title, e)
+            if verbose:
+                print(self.error)
+                print('')
+
+    def save_image(self, new_image, basedir, linkdir, now, verbose=False):
+        """
+        Moves the temporary image file we fetched (`new_image`) into place in
+        the given directory, symlinking to the previous day's image instead
+        if it hasn't changed (or if `new_image` is Pattern.NOT_MODIFIED).  If
+        `new_image` is Pattern.ALREADY_FETCHED, just use today's existing file.
+        """
+
+        if new_image is Pattern.ALREADY_FETCHED:
+            self.use_existing(basedir, linkdir, verbose=verbose)
             return
 
+        if new_image is Pattern.NOT_MODIFIED:
+            # The server says nothing's changed, so just reuse whatever
+            # extension we figured out for yesterday's image.
+            ext = os.path.splitext(self.last_info['filename'])[1][1:]
+        else:
+            ext = self.new_ext
+
         # Grab yesterday's date so we can check to see if that file exists, and if it's
         # the same file.
         yesterday = now - datetime.timedelta(days=1)
@@ -199,66 +827,91 @@ class Pattern(object):
 
         # Big ol' block here, various OS interactions.  Just try/except the whole thing.
         try:
-            # Check for yesterday's file.
+            # Check for yesterday's file.  This follows symlinks, so that a
+            # dangling link counts as not having a previous file at all.
+            try:
+                last_stat = os.stat(last_filename)
+            except FileNotFoundError:
+                last_stat = None
+            if new_image is Pattern.NOT_MODIFIED:
+                new_hash = self.read_hash(last_filename)
+                is_same = True
+            else:
+                new_hash = self.new_hash
+                is_same = False
+                if last_stat and last_stat.st_size != self.new_size:
+                    # Different sizes can't be the same image, so there's no
+                    # need to look any further.
+                    if verbose:
+                        print('    Previous file exists, but differs in size.')
+                elif last_stat:
+                    if verbose:
+                        print('    Previous file exists, checking contents.')
+
+                    # If we stored a hash alongside the previous file, compare
+                    # against that rather than reading in the whole image.
+                    last_hash = self.read_hash(last_filename)
+                    if last_hash is None:
+                        is_same = self.same_contents(last_filename, new_image)
+                    else:
+                        is_same = (last_hash == new_hash)
+
+            # Here's the comparison
             write_file = True
-            if os.path.exists(last_filename):
+            if is_same:
+                write_file = False
                 if verbose:
-                    print('    Previous file exists, checking contents.')
-                with open(last_filename, 'rb') as df:
-                    old_image_data = df.read()
-
-                # Here's the comparison
-                if old_image_data == new_image_data:
-                    write_file = False
-                    if verbose:
-                        print('    Previous strip is the same, just symlinking')
-                    # If the image file already exists, remove it, or else we'll get an
-                    # error
-                    if os.path.exists(img_filename):
-                        os.unlink(img_filename)
-                    if os.path.islink(last_filename):
-                        # We *could*, if we were sufficiently motivated, ensure that
-                        # we follow a potential symlink chain all the way back to a
-                        # real file and then symlink to that.  Turns out I don't actually
-                        # care enough to do that, for two reasons:
-                        #   1) That'll never actually happen without manual intervention
-                        #   2) Even if it did, there's no way we'd reach the kernel's
-                        #      symlink chain limit since we're by definition chopping off
-                        #      one level anyway.
-                        real_file = os.readlink(last_filename)
-                        os.symlink(real_file, img_filename)
-                        self.unchanged_since = real_file
-                        if real_file[0] == '/':
-                            prev_full = real_file
-                        else:
-                            prev_full = os.path.join(os.path.dirname(last_filename), real_file)
+                    print('    Previous strip is the same, just symlinking')
+                # If the image file already exists, remove it, or else we'll get an
+                # error
+                try:
+                    os.unlink(img_filename)
+                except FileNotFoundError:
+                    pass
+                # readlink() will fail if yesterday's file isn't a symlink, which
+                # saves us a separate check.
+                try:
+                    real_file = os.readlink(last_filename)
+                except OSError:
+                    real_file = None
+                if real_file:
+                    # We *could*, if we were sufficiently motivated, ensure that
+                    # we follow a potential symlink chain all the way back to a
+                    # real file and then symlink to that.  Turns out I don't actually
+                    # care enough to do that, for two reasons:
+                    #   1) That'll never actually happen without manual intervention
+                    #   2) Even if it did, there's no way we'd reach the kernel's
+                    #      symlink chain limit since we're by definition chopping off
+                    #      one level anyway.
+                    os.symlink(real_file, img_filename)
+                    self.unchanged_since = real_file
+                    if real_file[0] == '/':
+                        prev_full = real_file
                     else:
-                        os.symlink(last_filename_base, img_filename)
-                        self.unchanged_since = last_filename_base
-                        prev_full = last_filename
+                        prev_full = os.path.join(os.path.dirname(last_filename), real_file)
+                else:
+                    os.symlink(last_filename_base, img_filename)
+                    self.unchanged_since = last_filename_base
+                    prev_full = last_filename
 
             # If we have self.unchanged_since at this point, it's a filename.  Turn
             # it into a datetime object.
             if self.unchanged_since:
-                try:
-                    filename_parts = self.unchanged_since.split('-')
-                    self.unchanged_since = datetime.date(int(filename_parts[0]),
-                        int(filename_parts[1]),
-                        int(filename_parts[2]))
-                except Exception as e:
-                    # If the filename we found doesn't match our standard pattern,
-                    # attempt to just use the mtime of the file
-                    self.unchanged_since = datetime.datetime.fromtimestamp(os.path.getmtime(prev_full))
-                    if verbose:
-                        print('    Strip is on hold but previous filename cannot be parsed, using previous file\'s mtime')
+                self.unchanged_since = self.unchanged_date(self.unchanged_since,
+                    prev_full, verbose=verbose)
 
             if write_file:
-                # Write out our new file
-                with open(img_filename, 'wb') as df:
-                    df.write(new_image_data)
+                # Move our new file into place
+                os.replace(new_image, img_filename)
                 if verbose:
                     print('    Saved at %s' % (img_filename))
 
+            # Store our hash and response info regardless, so tomorrow's checks
+            # are cheap even if today's file is just a symlink.
+            if new_hash:
+                self.write_hash(img_filename, new_hash)
+            self.write_info(basedir, now, img_filename_base)
+
             # Store our URL for later retrieval
             self.url = os.path.join(urllib.parse.quote(linkdir), img_filename_base)
 
@@ -270,6 +923,15 @@ class Pattern(object):
                 print('')
             return
 
+        finally:
+
+            # Clean up our temporary file, if it's still around
+            if new_image is not Pattern.NOT_MODIFIED:
+                try:
+                    os.unlink(new_image)
+                except FileNotFoundError:
+                    pass
+
 class Strip(object):
     """
     Information about the strip itself
@@ -288,6 +950,9 @@ class Strip(object):
         else:
             self.searchpage = homepage
         self.intermediate_pattern = None
+        self._intermediate_re = None
+        self._intermediate_bytes_re = None
+        self._intermediate_prefix = ''
         self.found_intermediate = None
         self.intermediate_url = None
         self.intermediate_relative = False
@@ -315,6 +980,7 @@ class Strip(object):
         Sets our main comic search pattern.
         """
         self.patterns[0].pattern = searchpattern
+        self.patterns[0].compile()
 
     def add_extra(self, title, pattern, mode):
         """
@@ -323,12 +989,22 @@ class Strip(object):
         pattern = Pattern(title=title, pattern=pattern, mode=mode)
         self.patterns.append(pattern)
 
+    def parse_extra(self, option, value, mode):
+        """
+        Adds a new "extra" pattern from the pipe-delimited value of the given
+        config file option.  Raises ValueError if the value is incomplete.
+        """
+        extra_parts = value.split('|', maxsplit=1)
+        if len(extra_parts) != 2:
+            raise ValueError('Incomplete %s stanza' % (option))
+        self.add_extra(extra_parts[0], extra_parts[1], mode)
+
     def unchanged_since_human(self):
         """
         Returns a human representation of our 'unchanged since' var
         """
         if self.unchanged_since:
-            return self.unchanged_since.strftime('%A, %B %d, %Y')
+            return human_date(self.unchanged_since)
         else:
             return 'n/a'
 
@@ -337,7 +1013,7 @@ class Strip(object):
         Returns a link to the day we've last been updated
         """
         if self.unchanged_since:
-            return self.unchanged_since.strftime('dailystrips-%Y.%m.%d.html')
+            return page_filename(self.unchanged_since)
         else:
             return 'index.html'
 
@@ -351,29 +1027,67 @@ class Strip(object):
         if self.baseurl == '$homepage':
             self.baseurl = self.homepage
 
-        # Set baseurl on all our Pattern objects
+        # Set baseurl on all our Pattern objects, and compile their regexes
+        # now so that a bad one gets reported while loading the config,
+        # rather than whenever that strip happens to be fetched.
         for pattern in self.patterns:
             pattern.baseurl = self.baseurl
+            if pattern.compile_error:
+                raise ValueError('Strip "%s" - "%s" pattern: %s' % (
+                    self.strip_id, pattern.title, pattern.compile_error))
+        if self.intermediate_pattern:
+            try:
+                (self._intermediate_re, self._intermediate_bytes_re) = _compile_search(
+                    self.intermediate_pattern)
+            except re.error as e:
+                raise ValueError('Strip "%s" - invalid intermediate pattern: %s' % (
+                    self.strip_id, e))
+
+        # Work out what, if anything, needs to go in front of the intermediate
+        # links we find.  This only depends on our searchpage, so there's no
+        # need to parse it on every fetch.
+        if self.intermediate_relative:
+            self._intermediate_prefix = self.searchpage
+        elif self.intermediate_needs_hostname:
+            parsed = urllib.parse.urlparse(self.searchpage)
+            self._intermediate_prefix = '%s://%s' % (parsed.scheme, parsed.netloc)
+        else:
+            self._intermediate_prefix = ''
+
+    def _resolve_intermediate(self, link):
+        """
+        Returns the full URL for the given intermediate link
+        """
+        return '%s%s' % (self._intermediate_prefix, link)
 
-    def fetch_html(self, verbose=False, useragent=None, ca_certs=None):
+    def get_page(self, session, url, page_cache=None):
         """
-        Fetches the searchpage and populates our result URLs
+        Fetches the given URL using the given requests.Session (through
+        `page_cache`, if we have one), returning a tuple of the page body
+        (as bytes) and the encoding to decode it with.
+        """
+        if page_cache:
+            return page_cache.fetch(session, url)
+        resp = session.get(url, verify=session.verify)
+        return (resp.content, _page_encoding(resp))
+
+    def fetch_html(self, session, verbose=False, page_cache=None):
+        """
+        Fetches the searchpage (using the given requests.Session, and the
+        given PageCache if we have one) and populates our result URLs
         """
 
         self.fetch_attempted = True
-        headers = {}
-        if useragent:
-            headers['User-Agent'] = useragent
 
         if verbose:
             print('------')
             print('Fetching HTML page for %s (%s)' % (self.name, self.strip_id))
             print('URL is: %s' % (self.searchpage))
+        # Where our patterns allow it, we search the raw page bytes rather
+        # than resp.text, to avoid decoding (and possibly charset-sniffing)
+        # the whole page.  Only the bits we match get decoded.
         try:
-            if ca_certs:
-                page_lines = requests.get(self.searchpage, headers=headers, verify=ca_certs).text.splitlines()
-            else:
-                page_lines = requests.get(self.searchpage, headers=headers).text.splitlines()
+            (page_data, page_encoding) = self.get_page(session, self.searchpage, page_cache)
         except Exception as e:
             self.error = 'ERROR: Unable to retrieve HTML for %s (%s) - %s: %s' % (
                 self.name, self.strip_id, self.searchpage, e)
@@ -392,19 +1106,16 @@ class Strip(object):
         if self.intermediate_pattern:
             if verbose:
                 print('Searching for intermediate pattern: %s' % (self.intermediate_pattern))
-            try:
-                intermediate_re = re.compile(self.intermediate_pattern)
-            except Exception as e:
-                self.error = 'ERROR: Unable to compile intermedate regex: %s' % (e)
-                if verbose:
-                    print(self.error)
-                    print('')
-                return
-            for line in page_lines:
-                match = intermediate_re.search(line)
+            if self._intermediate_bytes_re and _bytes_searchable(page_encoding):
+                match = self._intermediate_bytes_re.search(page_data)
+                if match:
+                    self.found_intermediate = match.group('result').decode(
+                        page_encoding, errors='replace')
+            else:
+                match = self._intermediate_re.search(
+                    page_data.decode(page_encoding, errors='replace'))
                 if match:
                     self.found_intermediate = match.group('result')
-                    break
 
             if not self.found_intermediate:
                 self.error = 'ERROR: Unable to find intermediate URL'
@@ -416,25 +1127,15 @@ class Strip(object):
             # Figure out what the actual intermediate URL is
             if verbose:
                 print('Found intermediate link: %s' % (self.found_intermediate))
-            if self.intermediate_relative or self.intermediate_needs_hostname:
-                if self.intermediate_relative:
-                    self.intermediate_url = '%s%s' % (self.searchpage, self.found_intermediate)
-                elif self.intermediate_needs_hostname:
-                    parsed = urllib.parse.urlparse(self.searchpage)
-                    self.intermediate_url = '%s://%s%s' % (parsed.scheme, parsed.netloc,
-                            self.found_intermediate)
-                if verbose:
-                    print('Converted intermediate URL: %s' % (self.intermediate_url))
-            else:
-                self.intermediate_url = self.found_intermediate
+            self.intermediate_url = self._resolve_intermediate(self.found_intermediate)
+            if verbose and self._intermediate_prefix:
+                print('Converted intermediate URL: %s' % (self.intermediate_url))
 
             if verbose:
                 print('Fetching intermediate URL: %s' % (self.intermediate_url))
             try:
-                if ca_certs:
-                    page_lines = requests.get(self.intermediate_url, headers=headers, verify=ca_certs).text.splitlines()
-                else:
-                    page_lines = requests.get(self.intermediate_url, headers=headers).text.splitlines()
+                (page_data, page_encoding) = self.get_page(session,
+                    self.intermediate_url, page_cache)
             except Exception as e:
                 self.error = 'ERROR: Unable to retrieve intermediate HTML for %s (%s) - %s: %s' % (
                     self.name, self.strip_id, self.intermediate_url, e)
@@ -445,9 +1146,17 @@ class Strip(object):
             if verbose:
                 print('Intermediate HTML successfully retrieved, starting on matches')
 
-        # Run our matches
+        # Run our matches.  Patterns which can't search the raw bytes share
+        # a single decoded copy of the page.
+        page_text = None
         for pattern in self.patterns:
-            if pattern.search_page(page_lines, verbose):
+            if pattern.searches_bytes(page_encoding):
+                search_data = page_data
+            else:
+                if page_text is None:
+                    page_text = page_data.decode(page_encoding, errors='replace')
+                search_data = page_text
+            if pattern.search_page(search_data, verbose, page_encoding):
                 if verbose:
                     print('    Found result: %s' % (pattern.result))
                     if pattern.is_image():
@@ -462,95 +1171,117 @@ class Strip(object):
         if verbose:
             print('')
 
-    def download(self, basedir, now, verbose=False, useragent=None, ca_certs=None):
+    def download(self, session, basedir, now, verbose=False, pool=None, force=False):
         """
-        Downloads the strip (and all extras) into the given `basedir`.
+        Downloads the strip (and all extras) into the given `basedir`,
+        using the given requests.Session.  If
+        `pool` is given, it should be a concurrent.futures Executor, and
+        all our images will be fetched from the web simultaneously.  Images
+        we already saved earlier today are reused unless `force` is set.
         """
 
-        # First make sure our base directory exists
+        # First make sure our base directory exists.  Just trying to create
+        # it avoids a race (and an extra stat) in the usual case where it's
+        # already there.
         real_basedir = os.path.join(basedir, self.name)
-        if not os.path.exists(real_basedir):
+        try:
+            os.makedirs(real_basedir)
             if verbose:
-                print('Creating directory: %s' % (real_basedir))
-            os.mkdir(real_basedir)
+                print('Created directory: %s' % (real_basedir))
+        except FileExistsError:
+            pass
+
+        # Start fetching all our images at once, if we can
+        if pool:
+            futures = [pool.submit(pattern.fetch_image, session, real_basedir, now,
+                    referer=self.searchpage,
+                    verbose=verbose,
+                    force=force)
+                for pattern in self.patterns]
 
         # Now loop through all our patterns
-        for pattern in self.patterns:
-            pattern.download_to(real_basedir, self.name, now,
-                referer=self.searchpage,
-                verbose=verbose,
-                useragent=useragent,
-                ca_certs=ca_certs)
+        for (idx, pattern) in enumerate(self.patterns):
+            if pool:
+                new_image = futures[idx].result()
+            else:
+                new_image = pattern.fetch_image(session, real_basedir, now,
+                    referer=self.searchpage,
+                    verbose=verbose,
+                    force=force)
+            if new_image is not None:
+                pattern.save_image(new_image, real_basedir, self.name, now,
+                    verbose=verbose)
             if not self.unchanged_since and pattern.unchanged_since:
                 self.unchanged_since = pattern.unchanged_since
 
+    def _validate(self):
+        """
+        Returns a string detailing why the strip is invalid, or None if
+        we have all the necessary information to be a valid strip.
+        """
+        if self.name is None:
+            return 'No name defined'
+        elif self.homepage is None:
+            return 'No homepage defined'
+        elif self.patterns[0].pattern is None:
+            return 'No searchpattern defined'
+        else:
+            return None
+
     def valid(self):
         """
         Returns True if we have all necessary information to be a valid strip,
         and False otherwise.
         """
-        if (self.name is None or self.homepage is None or
-                self.patterns[0].pattern is None):
-            return False
-        else:
-            return True
+        return self._validate() is None
 
     def invalid_reason(self):
         """
         Returns a string detailing why the strip is invalid, if it's not.
         """
-        if self.valid():
-            return ''
-        else:
-            if self.name is None:
-                return 'No name defined'
-            elif self.homepage is None:
-                return 'No homepage defined'
-            elif self.patterns[0].pattern is None:
-                return 'No searchpattern defined'
-            else:
-                return 'Unknown error'
+        return self._validate() or ''
 
-    def print_strip_info(self):
+    def print_strip_info(self, file=None):
         """
-        Prints out our strip information
+        Prints out our strip information, to `file` if given (otherwise
+        to stdout)
         """
-        print('%s: %s' % (self.strip_id, self.name))
+        print('%s: %s' % (self.strip_id, self.name), file=file)
         if self.onhold:
-            print("\t(marked as 'on hold')")
+            print("\t(marked as 'on hold')", file=file)
         if self.artist is not None:
-            print("\tArtist: %s" % (self.artist))
-        print("\tHomepage: %s" % (self.homepage))
-        print("\tSearch Page: %s" % (self.searchpage))
-        print("\tBase URL: %s" % (self.baseurl))
+            print("\tArtist: %s" % (self.artist), file=file)
+        print("\tHomepage: %s" % (self.homepage), file=file)
+        print("\tSearch Page: %s" % (self.searchpage), file=file)
+        print("\tBase URL: %s" % (self.baseurl), file=file)
         if self.intermediate_pattern:
-            print("\tIntermediate Pattern: %s" % (self.intermediate_pattern))
+            print("\tIntermediate Pattern: %s" % (self.intermediate_pattern), file=file)
             suffixes = []
             if self.intermediate_relative:
                 suffixes.append('relative link')
             elif self.intermediate_needs_hostname:
                 suffixes.append('needs hostname')
-            print("\tIntermediate Properties: %s" % (', '.join(suffixes)))
+            print("\tIntermediate Properties: %s" % (', '.join(suffixes)), file=file)
             if len(suffixes) == 0:
                 suffixes.append('full URL')
             if self.found_intermediate:
-                print("\tIntermediate Link: %s" % (self.found_intermediate))
+                print("\tIntermediate Link: %s" % (self.found_intermediate), file=file)
             if self.intermediate_url:
-                print("\tIntermediate URL: %s" % (self.intermediate_url))
+                print("\tIntermediate URL: %s" % (self.intermediate_url), file=file)
         for pattern in self.patterns:
             print("\t%s pattern (%s): %s" % (pattern.title, Pattern.MODE_TXT[pattern.mode],
-                pattern.pattern))
+                pattern.pattern), file=file)
         if self.fetch_attempted:
-            print("\t------")
+            print("\t------", file=file)
             if self.error is None:
                 for pattern in self.patterns:
                     if pattern.result is not None:
-                        print("\t%s: %s" % (pattern.title, pattern.get_result()))
+                        print("\t%s: %s" % (pattern.title, pattern.get_result()), file=file)
                     else:
-                        print("\t%s: %s" % (pattern.title, pattern.get_error()))
+                        print("\t%s: %s" % (pattern.title, pattern.get_error()), file=file)
             else:
-                print("\tError: %s" % (self.error))
-        print('')
+                print("\tError: %s" % (self.error), file=file)
+        print('', file=file)
 
 class Group(object):
     """
@@ -580,14 +1311,15 @@ class Group(object):
             except KeyError as e:
                 raise Exception('Group "%s" - strip "%s" is unknown' % (self.group_id, strip_id))
 
-    def print_group_info(self):
+    def print_group_info(self, file=None):
         """
-        Prints out our group information
+        Prints out our group information, to `file` if given (otherwise
+        to stdout)
         """
-        print('Group %s:' % (self.group_id))
+        print('Group %s:' % (self.group_id), file=file)
         for strip in self.strips:
-            print(' * %s - %s' % (strip.strip_id, strip.name))
-        print('')
+            print(' * %s - %s' % (strip.strip_id, strip.name), file=file)
+        print('', file=file)
 
     def __len__(self):
         return len(self.strip_ids)
@@ -597,21 +1329,89 @@ class Collection(object):
     Our complete collection of strips
     """
 
-    def __init__(self, useragent, configfile, verbose=False, ca_certs=None):
+    # Most connections we'll have open to any one host at a time, however
+    # many strips we're fetching at once.  A lot of strips share a host
+    # (gocomics.com, for instance), and we'd rather not hammer it.
+    MAX_PER_HOST = 2
+
+    # Handlers for strip options which take a value, called with the strip
+    # and the option's value.  Note that searchpattern and extra_* don't strip
+    # trailing whitespace, since it might be part of the pattern.
+    _STRIP_HANDLERS = {
+        'name': lambda strip, value: setattr(strip, 'name', value.rstrip()),
+        'artist': lambda strip, value: setattr(strip, 'artist', value.rstrip()),
+        'homepage': lambda strip, value: strip.set_homepage(value.rstrip()),
+        'searchpage': lambda strip, value: setattr(strip, 'searchpage', value.rstrip()),
+        'searchpattern': lambda strip, value: strip.set_searchpattern(value),
+        'intermediate_pattern': lambda strip, value: setattr(strip, 'intermediate_pattern', value.rstrip()),
+        'baseurl': lambda strip, value: setattr(strip, 'baseurl', value.rstrip()),
+        'extra_txt': lambda strip, value: strip.parse_extra('extra_txt', value, Pattern.M_TEXT),
+        'extra_img': lambda strip, value: strip.parse_extra('extra_img', value, Pattern.M_IMG),
+    }
+
+    # Strip options which don't take a value, mapped to the attribute they
+    # switch on.
+    _STRIP_FLAGS = {
+        'onhold': 'onhold',
+        'intermediate_relative': 'intermediate_relative',
+        'intermediate_needs_hostname': 'intermediate_needs_hostname',
+    }
+
+    def __init__(self, useragent, configfile, verbose=False, ca_certs=None,
+            max_concurrency=8, force=False, gzip_html=False):
         """
-        Constructor.
+        Constructor.  `max_concurrency` is the number of strips which
+        will be fetched at the same time, and also the number of images
+        which will be downloaded at once (though no more than MAX_PER_HOST
+        connections are made to a single host).  If `force` is set, images will
+        be downloaded even if we already saved them earlier today.  If
+        `gzip_html` is set, gzipped copies of our HTML pages are written out too.
         """
         self.verbose = verbose
+        self.force = force
+        self.gzip_html = gzip_html
         self.useragent = useragent
         self.ca_certs = ca_certs
+        self.max_concurrency = max_concurrency
+        self.download_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+        # A single Session lets us reuse connections between requests, which
+        # is a big help when a strip's page and images are on the same host.
+        # Each host's connection pool is capped at MAX_PER_HOST, and blocks
+        # until a connection is free rather than opening more.
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': self.useragent})
+        # Note that requests lets REQUESTS_CA_BUNDLE and CURL_CA_BUNDLE from
+        # the environment override session.verify, so every request passes
+        # verify=session.verify explicitly to make sure --ca-certs wins.
+        if self.ca_certs:
+            self.session.verify = self.ca_certs
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16,
+            pool_maxsize=Collection.MAX_PER_HOST,
+            pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.page_cache = PageCache(os.path.join(CACHE_DIR, 'pages'))
         self.strips = {}
         self.groups = {}
         self.now = datetime.datetime.today()
         self.load_from_filename(configfile)
 
-        # Load in our Jinja2 template
-        env = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.dirname(__file__)))
-        self.template_main = env.get_template('dailystrips-main.html')
+        # Load in our Jinja2 template, and make sure it renders at all, so
+        # that a broken template stops us here rather than after we've
+        # downloaded everything.
+        try:
+            self.template_main = _main_template()
+            self.template_main.render({
+                    'humandate': human_date(self.now),
+                    'timestamp_full': self.now.strftime('%c'),
+                    'yesterday': None,
+                    'strips': [],
+                    'css': None,
+                })
+        except jinja2.TemplateError as e:
+            raise Exception('Could not render dailystrips template: %s' % (e))
 
     def load_error(self, filename, idx, line, error):
         """
@@ -621,7 +1421,7 @@ class Collection(object):
             raise Exception('%s: line %d: %s' % (filename, idx, error))
         else:
             raise Exception('%s: line %d: %s - Full line: %s' % (
-                filename, idx, error, line))
+                filename, idx, error, line.strip()))
 
     def load_from_filename(self, filename):
         """
@@ -632,28 +1432,24 @@ class Collection(object):
         with open(filename, 'r') as df:
             cur_strip = None
             cur_group = None
-            for (idx, line) in enumerate(df.readlines()):
-                idx += 1
-                line = line.lstrip().rstrip("\r\n")
-                if line == '':
-                    continue
-                if line[0] == '#':
-                    continue
-                parts = line.split(maxsplit=1)
-                if len(parts) == 0:
+            for (idx, line) in enumerate(df, start=1):
+                match = _CFG_LINE_RE.match(line)
+                if not match:
+                    # Blank line or comment
                     continue
+                (key, value) = match.group('key', 'value')
                 if cur_strip is None and cur_group is None:
-                    if parts[0] == 'strip':
-                        if len(parts) == 2:
-                            strip_id = parts[1].rstrip().lower()
+                    if key == 'strip':
+                        if value is not None:
+                            strip_id = value.rstrip().lower()
                             if strip_id in self.strips:
                                 self.load_error(filename, idx, line, 'Duplicate strip "%s" found' % (strip_id))
                             cur_strip = Strip(strip_id)
                         else:
                             self.load_error(filename, idx, line, 'Found "strip" without ID')
-                    elif parts[0] == 'group':
-                        if len(parts) == 2:
-                            group_id = parts[1].rstrip().lower()
+                    elif key == 'group':
+                        if value is not None:
+                            group_id = value.rstrip().lower()
                             if group_id in self.groups:
                                 self.load_error(filename, idx, line, 'Duplicate group "%s" found' % (group_id))
                             cur_group = Group(group_id)
@@ -662,63 +1458,45 @@ class Collection(object):
                     else:
                         self.load_error(filename, idx, line, 'Expecting "strip" or "group"')
                 elif cur_strip is not None:
-                    if parts[0] == 'end':
-                        if cur_strip.valid():
-                            cur_strip.finish()
+                    if key == 'end':
+                        invalid_reason = cur_strip._validate()
+                        if invalid_reason is None:
+                            try:
+                                cur_strip.finish()
+                            except ValueError as e:
+                                self.load_error(filename, idx, None, str(e))
                             self.strips[cur_strip.strip_id] = cur_strip
                             if self.verbose:
                                 print('Parsed strip "%s (%s)"' % (cur_strip.name, cur_strip.strip_id))
                             cur_strip = None
                         else:
                             self.load_error(filename, idx, None, 'Invalid strip "%s": %s' % (
-                                cur_strip.strip_id, 
-                                cur_strip.invalid_reason()))
+                                cur_strip.strip_id, invalid_reason))
                     else:
-                        if len(parts) == 1:
-                            if parts[0] == 'onhold':
-                                cur_strip.onhold = True
-                            elif parts[0] == 'intermediate_relative':
-                                cur_strip.intermediate_relative = True
-                            elif parts[0] == 'intermediate_needs_hostname':
-                                cur_strip.intermediate_needs_hostname = True
+                        if value is None:
+                            if key in Collection._STRIP_FLAGS:
+                                setattr(cur_strip, Collection._STRIP_FLAGS[key], True)
                             else:
                                 self.load_error(filename, idx, line, 'Missing option data')
                         else:
-                            if parts[0] == 'name':
-                                cur_strip.name = parts[1].rstrip()
-                            elif parts[0] == 'artist':
-                                cur_strip.artist = parts[1].rstrip()
-                            elif parts[0] == 'homepage':
-                                cur_strip.set_homepage(parts[1].rstrip())
-                            elif parts[0] == 'searchpage':
-                                cur_strip.searchpage = parts[1].rstrip()
-                            elif parts[0] == 'searchpattern':
-                                cur_strip.set_searchpattern(parts[1])
-                            elif parts[0] == 'intermediate_pattern':
-                                cur_strip.intermediate_pattern = parts[1].rstrip()
-                            elif parts[0] == 'baseurl':
-                                cur_strip.baseurl = parts[1].rstrip()
-                            elif parts[0] == 'extra_txt' or parts[0] == 'extra_img':
-                                if parts[0] == 'extra_txt':
-                                    mode = Pattern.M_TEXT
-                                else:
-                                    mode = Pattern.M_IMG
-                                extra_parts = parts[1].split('|', maxsplit=1)
-                                if len(extra_parts) != 2:
-                                    self.load_error(filename, idx, line, 'Incomplete extra_txt stanza')
-                                cur_strip.add_extra(extra_parts[0], extra_parts[1], mode)
+                            handler = Collection._STRIP_HANDLERS.get(key)
+                            if handler is None:
+                                self.load_error(filename, idx, line, 'Unknown option "%s"' % (key))
                             else:
-                                self.load_error(filename, idx, line, 'Unknown option "%s"' % (parts[0]))
+                                try:
+                                    handler(cur_strip, value)
+                                except ValueError as e:
+                                    self.load_error(filename, idx, line, str(e))
                 elif cur_group is not None:
-                    if len(parts) > 1:
+                    if value is not None:
                         self.load_error(filename, idx, line, 'Unknown group line')
-                    if parts[0] == 'end':
+                    if key == 'end':
                         self.groups[cur_group.group_id] = cur_group
                         if self.verbose:
                             print('Parsed group "%s": %d strips' % (cur_group.group_id, len(cur_group)))
                         cur_group = None
                     else:
-                        cur_group.add_strip(parts[0].rstrip().lower())
+                        cur_group.add_strip(key.rstrip().lower())
                 else:
                     self.load_error(filename, idx, line, 'Something went super wrong, how are we here?')
 
@@ -734,6 +1512,11 @@ class Collection(object):
         for group in self.groups.values():
             group.finish(self)
 
+        # Keep our strips and groups sorted by ID, so that listing them
+        # doesn't have to sort them each time.
+        self.strips = dict(sorted(self.strips.items()))
+        self.groups = dict(sorted(self.groups.items()))
+
         if self.verbose:
             print('Finished parsing config file')
 
@@ -743,39 +1526,79 @@ class Collection(object):
         """
         return self.strips[strip_id]
 
-    def list_strips(self):
+    def list_strips(self, file=None):
         """
         Print out a list of all the strips we have.
         """
-        for strip_id in sorted(self.strips.keys()):
-            self.strips[strip_id].print_strip_info()
+        for strip in self.strips.values():
+            strip.print_strip_info(file=file)
 
-    def list_groups(self):
+    def list_groups(self, file=None):
         """
         Print out a list of all the groups we have.
         """
-        for group_id in sorted(self.groups.keys()):
-            self.groups[group_id].print_group_info()
+        for group in self.groups.values():
+            group.print_group_info(file=file)
 
     def list_all(self):
         """
-        Outputs both our strips and groups.
+        Outputs both our strips and groups.  The whole listing is built up
+        in memory and written out in one go, rather than a line at a time.
         """
-        self.list_strips()
-        self.list_groups()
+        buf = io.StringIO()
+        self.list_strips(file=buf)
+        self.list_groups(file=buf)
+        sys.stdout.write(buf.getvalue())
+
+    def close(self):
+        """
+        Cleans up our HTTP session and download threads, and saves our
+        page cache.
+        """
+        self.page_cache.save()
+        self.session.close()
+        self.download_pool.shutdown()
+
+    def fetch_strip(self, strip, download_dir=None):
+        """
+        Fetches a single strip, and downloads it if we've been given
+        a `download_dir`.
+        """
+        strip.fetch_html(self.session, verbose=self.verbose,
+            page_cache=self.page_cache)
+        if download_dir and not strip.error:
+            # As in process_strips(), keep verbose output in order
+            if self.verbose:
+                pool = None
+            else:
+                pool = self.download_pool
+            strip.download(self.session, verbose=self.verbose,
+                basedir=download_dir, now=self.now,
+                pool=pool, force=self.force)
 
     def process_strips(self, strips, download_dir=None, css_file=None):
         """
         Fetches and prints the strips
         """
-        for strip in strips:
-            strip.fetch_html(verbose=self.verbose, useragent=self.useragent, ca_certs=self.ca_certs)
-            if download_dir:
-                if not strip.error:
-                    strip.download(verbose=self.verbose, useragent=self.useragent,
-                        basedir=download_dir, now=self.now,
-                        ca_certs=self.ca_certs)
-            else:
+
+        # Each strip generally lives on a different host and we spend nearly
+        # all our time waiting on the network, so fetch several at once.
+        # Verbose output would be an unreadable jumble if strips were
+        # interleaved, though, so stick to one at a time in that case.
+        # There's no point starting more threads than we have strips.
+        if self.verbose:
+            max_workers = 1
+        else:
+            max_workers = max(1, min(self.max_concurrency, len(strips)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.fetch_strip, strip, download_dir)
+                for strip in strips]
+
+        # Calling result() will re-raise anything which went wrong in a worker
+        for future in futures:
+            future.result()
+        if not download_dir:
+            for strip in strips:
                 strip.print_strip_info()
 
         # Finally, if we've been told to download, generate our HTML
@@ -783,66 +1606,177 @@ class Collection(object):
 
             # If we've been told to use a CSS file, and that CSS file is present
             # in our program directory, and the file is NOT present in the destination
-            # directory, copy it over.
+            # directory, copy it over.  Opening the destination with 'x' checks
+            # for its existence and creates it in one go.
             if css_file:
                 css_dst_filename = os.path.join(download_dir, css_file)
-                if not os.path.exists(css_dst_filename):
-                    css_src_filename = os.path.join(os.path.dirname(__file__), css_file)
-                    if os.path.exists(css_src_filename):
-                        if self.verbose:
-                            print('Copying default CSS file to: %s' % (css_dst_filename))
-                        shutil.copyfile(css_src_filename, css_dst_filename)
+                css_src_filename = os.path.join(_MODULE_DIR, css_file)
+                try:
+                    with open(css_src_filename, 'rb') as src, open(css_dst_filename, 'xb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    if self.verbose:
+                        print('Copied default CSS file to: %s' % (css_dst_filename))
+                except (FileNotFoundError, FileExistsError):
+                    pass
 
             # Output our actual HTML
-            cur_filename = 'dailystrips-%04d.%02d.%02d.html' % (self.now.year, self.now.month, self.now.day)
-            yesterday = self.now - datetime.timedelta(days=1)
-            prev_filename = 'dailystrips-%04d.%02d.%02d.html' % (yesterday.year, yesterday.month, yesterday.day)
+            cur_filename = page_filename(self.now)
+            prev_filename = page_filename(self.now - datetime.timedelta(days=1))
             prev_filename_full = os.path.join(download_dir, prev_filename)
-            if not os.path.exists(prev_filename_full):
-                prev_filename = None
-
             try:
-                page_content = self.template_main.render({
-                        'humandate': self.now.strftime('%A, %B %d, %Y'),
-                        'timestamp_full': self.now.strftime('%c'),
-                        'yesterday': prev_filename,
-                        'strips': strips,
-                        'css': css_file,
-                    })
-            except Exception as e:
-                page_content = 'ERROR: Could not render dailystrips template: %s' % (e)
-                if self.verbose:
-                    print(page_content)
+                os.stat(prev_filename_full)
+            except FileNotFoundError:
+                prev_filename = None
 
-            # Just let the Exception bubble up here, if we get one.
-            # For some reason, if the file already exists, we sometimes get a BlockingIOError
-            # when trying to write to it.  To try and avoid that, unlink it first if need
-            # be.
+            # Just let the Exception bubble up here, if we get one from the
+            # filesystem or the template.
+            # The page is written to a temporary file first and then moved into
+            # place, so anyone looking at it never sees a half-written page.
+            # As in Pattern.stream_to_file(), we don't use tempfile here because
+            # its files are only readable by us.
             if self.verbose:
                 print('Writing current dailystrips index to: %s' % (cur_filename))
             full_filename = os.path.join(download_dir, cur_filename)
-            if os.path.exists(full_filename):
-                os.unlink(full_filename)
-            with open(full_filename, 'w') as df:
-                df.write(page_content)
+            tmp_filename = os.path.join(download_dir, '.%s%s' % (cur_filename, Pattern.TMP_EXT))
+            try:
+                with open(tmp_filename, 'w') as df:
+                    # Stream the template straight into the file rather than
+                    # building the whole page in memory first.
+                    self.template_main.stream({
+                            'humandate': human_date(self.now),
+                            'timestamp_full': self.now.strftime('%c'),
+                            'yesterday': prev_filename,
+                            'strips': strips,
+                            'css': css_file,
+                        }).dump(df)
+            except:
+                # Don't leave a half-rendered page lying around, and don't
+                # point index.html at it.
+                os.unlink(tmp_filename)
+                raise
+            os.replace(tmp_filename, full_filename)
+            if self.gzip_html:
+                self.write_gzip(full_filename)
 
             # Symlink a new index.html
             if self.verbose:
                 print('Symlinking index.html to %s' % (cur_filename))
-            index_filename = os.path.join(download_dir, 'index.html')
-            if os.path.exists(index_filename):
-                os.unlink(index_filename)
-            os.symlink(cur_filename, index_filename)
+            self.replace_symlink(cur_filename, os.path.join(download_dir, 'index.html'))
+            if self.gzip_html:
+                self.replace_symlink(cur_filename + '.gz',
+                    os.path.join(download_dir, 'index.html.gz'))
 
             # And finally update our previous day's "nextday" tag, if we have a previous day.
             if prev_filename:
                 if self.verbose:
                     print('Updating "next day" link in %s' % (prev_filename))
-                with open(prev_filename_full, 'r') as df:
-                    prev_content = df.read()
-                os.unlink(prev_filename_full)
-                with open(prev_filename_full, 'w') as df:
-                    df.write(prev_content.replace('<!--nextday-->', ' | <a href="%s">Next day</a>' % (cur_filename)))
+                if self.link_next_day(prev_filename_full, cur_filename) and self.gzip_html:
+                    self.write_gzip(prev_filename_full)
+
+    def replace_symlink(self, target, link_filename):
+        """
+        Points the symlink `link_filename` at `target`, by way of a temporary
+        symlink, so that `link_filename` is never missing.
+        """
+        (dirname, basename) = os.path.split(link_filename)
+        tmp_filename = os.path.join(dirname, '.%s%s' % (basename, Pattern.TMP_EXT))
+        try:
+            os.unlink(tmp_filename)
+        except FileNotFoundError:
+            pass
+        os.symlink(target, tmp_filename)
+        os.replace(tmp_filename, link_filename)
+
+    def write_gzip(self, filename):
+        """
+        Writes out a gzipped copy of the given file alongside it, for web
+        servers which can serve precompressed files (such as nginx's
+        gzip_static).
+        """
+        gz_filename = '%s.gz' % (filename)
+        (dirname, basename) = os.path.split(filename)
+        tmp_filename = os.path.join(dirname, '.%s.gz%s' % (basename, Pattern.TMP_EXT))
+        try:
+            # gzip.open() would record the temporary filename in the gzip
+            # header, so give GzipFile the real one instead.
+            with open(filename, 'rb') as src, open(tmp_filename, 'wb') as raw, \
+                    gzip.GzipFile(filename=basename, mode='wb', compresslevel=6,
+                        fileobj=raw) as dst:
+                shutil.copyfileobj(src, dst)
+        except:
+            try:
+                os.unlink(tmp_filename)
+            except FileNotFoundError:
+                pass
+            raise
+        os.replace(tmp_filename, gz_filename)
+
+    # Pages bigger than this get their "nextday" markers patched by
+    # streaming them through a temporary file, rather than in memory.
+    STREAM_THRESHOLD = 1024*1024
+
+    def link_next_day(self, prev_filename_full, cur_filename):
+        """
+        Replaces the "nextday" markers in the previous day's page with links
+        to `cur_filename`.  Small files are patched in place, only rewriting
+        everything from the first marker onwards; large ones are streamed
+        through a temporary file.  Returns True if the file was changed.
+        """
+        marker = b'<!--nextday-->'
+        link = (' | <a href="%s">Next day</a>' % (cur_filename)).encode('utf-8')
+        with open(prev_filename_full, 'r+b') as df:
+            size = os.fstat(df.fileno()).st_size
+            # mmap refuses to map empty files
+            if size == 0:
+                return False
+            if size > Collection.STREAM_THRESHOLD:
+                return self.stream_replace(df, prev_filename_full, marker, link)
+            with mmap.mmap(df.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                idx = mm.find(marker)
+                if idx == -1:
+                    return False
+                tail = mm[idx:]
+            df.seek(idx)
+            df.write(tail.replace(marker, link))
+            df.truncate()
+        return True
+
+    def stream_replace(self, df, filename, marker, replacement):
+        """
+        Copies the open file `df` to a temporary file in chunks, replacing
+        `marker` with `replacement` as it goes, and moves the result over
+        `filename`.  Enough of each chunk is held back to catch markers
+        which straddle a chunk boundary.  Returns True if any marker was
+        found, otherwise leaves `filename` alone and returns False.
+        """
+        (dirname, basename) = os.path.split(filename)
+        tmp_filename = os.path.join(dirname, '.%s%s' % (basename, Pattern.TMP_EXT))
+        overlap = len(marker) - 1
+        found = False
+        try:
+            with open(tmp_filename, 'wb') as tf:
+                pending = b''
+                while True:
+                    chunk = df.read(Pattern.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    pending += chunk
+                    if marker in pending:
+                        found = True
+                        pending = pending.replace(marker, replacement)
+                    # Anything before the last `overlap` bytes can't be
+                    # the start of a marker any more
+                    keep = max(len(pending) - overlap, 0)
+                    tf.write(pending[:keep])
+                    pending = pending[keep:]
+                tf.write(pending)
+            if found:
+                shutil.copymode(filename, tmp_filename)
+                os.replace(tmp_filename, filename)
+        finally:
+            if not found:
+                os.unlink(tmp_filename)
+        return found
 
     def process_strip_id(self, strip_id, download_dir=None, css_file=None):
         """
@@ -860,7 +1794,10 @@ class Collection(object):
             raise Exception('Group "%s" is not known' % (group_id))
         self.process_strips(self.groups[group_id].strips, download_dir, css_file)
 
-if __name__ == '__main__':
+def main():
+    """
+    Command-line entry point
+    """
 
     # Parse some arguments!
 
@@ -902,18 +1839,34 @@ if __name__ == '__main__':
 
     parser.add_argument('-c', '--config',
         type=str,
-        default=os.path.join(os.path.dirname(__file__), 'strips.def'),
+        default=os.path.join(_MODULE_DIR, 'strips.def'),
         help='Configuration file')
 
     parser.add_argument('-u', '--useragent',
         type=str,
-        default='Mozilla/5.0 (X11; Linux x86_64; rv:51.0) Gecko/20100101 Firefox/51.0',
+        default=DEFAULT_USERAGENT,
         help='User-Agent to use in HTTP headers when requesting pages')
 
     parser.add_argument('--ca-certs',
         type=str,
         help='Use the specified CA bundle instead of python-requests\' own bundle')
 
+    parser.add_argument('--max-concurrency',
+        type=int,
+        default=8,
+        help="""Number of strips (and images) to fetch at the same time.  No more than
+            %d connections are made to any one server at once, though.""" % (
+            Collection.MAX_PER_HOST))
+
+    parser.add_argument('-f', '--force',
+        action='store_true',
+        help='Download images even if we already have them from an earlier run today')
+
+    parser.add_argument('--gzip',
+        action='store_true',
+        help="""Also write gzipped copies of the generated HTML (only has an effect with
+            --download), for web servers which can serve precompressed files""")
+
     args = parser.parse_args()
 
     if not os.path.exists(args.config):
@@ -922,15 +1875,28 @@ if __name__ == '__main__':
     if args.download and not os.path.exists(args.download):
         parser.error('Download directory "%s" does not exist' % (args.download))
 
+    if args.max_concurrency < 1:
+        parser.error('--max-concurrency must be at least 1')
+
     # Now launch the app
 
     collection = Collection(useragent=args.useragent,
         configfile=args.config,
         verbose=args.verbose,
-        ca_certs=args.ca_certs)
-    if args.list:
-        collection.list_all()
-    elif args.strip:
-        collection.process_strip_id(args.strip, args.download, args.css)
-    elif args.group:
-        collection.process_group_id(args.group, args.download, args.css)
+        ca_certs=args.ca_certs,
+        max_concurrency=args.max_concurrency,
+        force=args.force,
+        gzip_html=args.gzip)
+    try:
+        if args.list:
+            collection.list_all()
+        elif args.strip:
+            collection.process_strip_id(args.strip, args.download, args.css)
+        elif args.group:
+            collection.process_group_id(args.group, args.download, args.css)
+    finally:
+        collection.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())